@@ -4,24 +4,42 @@ PDF Fusion Pro - 激活服务器
 支持 Gumroad Webhook (form-urlencoded 格式)
 """
 
+# gevent 猴子补丁必须在导入其他模块之前执行，
+# 使 socket/ssl（smtplib、requests 等）在 gevent worker 下变为协作式非阻塞
+try:
+    from gevent import monkey
+    monkey.patch_all()
+    GEVENT_ENABLED = True
+except ImportError:
+    GEVENT_ENABLED = False
+
 import os
+import re
+import sys
 import json
+import atexit
 import base64
 import hashlib
 import logging
+import queue
 import smtplib
 import threading
 import time
+from contextlib import contextmanager
+from itertools import count
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import lru_cache, wraps
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formatdate
 from urllib.parse import parse_qs, unquote
 
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider, JSONProvider
 from flask_cors import CORS
-from cryptography.fernet import Fernet
+from werkzeug.middleware.proxy_fix import ProxyFix
+from cryptography.fernet import Fernet, InvalidToken
 
 # 配置日志
 logging.basicConfig(
@@ -30,8 +48,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """基于 orjson 的 JSON 序列化，响应体直接输出 UTF-8 字节"""
+    
+    # 与 Flask 默认行为保持一致：按键排序、日期时间输出为 HTTP 日期格式
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=self.option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=DefaultJSONProvider.default, option=self.option),
+            mimetype="application/json"
+        )
+
 # 初始化Flask应用
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # 配置类
@@ -42,6 +80,8 @@ class Config:
     ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', '')
     ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '')
     DATABASE_URL = os.getenv('DATABASE_URL', '')
+    # 每个连接预处理热点 SQL；仅用于直连或 PgBouncer 会话模式（事务模式下 PREPARE 不可用）
+    DB_PREPARE_STATEMENTS = os.getenv('DB_PREPARE_STATEMENTS', 'False').lower() == 'true'
     
     # 邮件配置
     SMTP_HOST = os.getenv('SMTP_HOST', '')
@@ -57,10 +97,14 @@ class Config:
     SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', '30'))  # 服务器超时时间（秒）
     REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '10'))  # 请求超时时间（秒）
     DEBUG_MODE = os.getenv('DEBUG', 'False').lower() == 'true'
+    # 前置反向代理层数（Render 为 1），用于从 X-Forwarded-For 取真实客户端 IP；直连部署设为 0
+    TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', '1'))
     
     # 缓存配置
     CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'True').lower() == 'true'
     CACHE_TTL = int(os.getenv('CACHE_TTL', '3600'))  # 缓存有效期（秒）
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))  # 最大缓存条目数
+    VERIFY_CACHE_TTL = int(os.getenv('VERIFY_CACHE_TTL', '60'))  # 激活码验证结果缓存有效期（秒）
     
     @classmethod
     def validate(cls):
@@ -83,14 +127,92 @@ class Config:
         return True
 
 # 导入数据库连接池
-from psycopg2 import pool
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# 数据库引擎（连接池）
+db_engine = None
+
+# 热点 SQL（验证、设备登记、保存激活码、保存购买记录）
+# 启用 DB_PREPARE_STATEMENTS 时在每个新连接上 PREPARE 一次，之后只需 EXECUTE，
+# 省去每次执行时的解析和规划
+PREPARED_STATEMENTS = {
+    'verify_lookup': '''
+    WITH a AS (
+        SELECT id, email, product_type, max_devices, valid_until
+        FROM activations
+        WHERE activation_code = %s
+    )
+    SELECT a.*,
+        (SELECT COUNT(*) FROM device_activations d
+         WHERE d.activation_id = a.id AND d.is_active = TRUE) AS device_count,
+        (SELECT d.is_active FROM device_activations d
+         WHERE d.activation_id = a.id AND d.device_id = %s) AS device_is_active
+    FROM a
+    ''',
+    'verify_activate': '''
+    WITH device AS (
+        INSERT INTO device_activations (activation_id, device_id, device_name)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (activation_id, device_id)
+        DO UPDATE SET last_used = CURRENT_TIMESTAMP, is_active = TRUE
+        RETURNING activation_id
+    )
+    UPDATE activations 
+    SET is_used = TRUE, used_at = CURRENT_TIMESTAMP, used_by_device = %s
+    FROM device
+    WHERE activations.id = device.activation_id
+    ''',
+    'activation_insert': '''
+    INSERT INTO activations 
+    (email, activation_code, product_type, days_valid, max_devices, valid_until, metadata)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (activation_code) DO NOTHING
+    ''',
+    'purchase_upsert': '''
+    INSERT INTO purchases (purchase_id, email, product_name, gumroad_data, processed)
+    VALUES (%s, %s, %s, %s, TRUE)
+    ON CONFLICT (purchase_id) 
+    DO UPDATE SET 
+        processed = TRUE,
+        processed_at = CURRENT_TIMESTAMP
+    ''',
+}
 
-# 数据库连接池
-db_pool = None
+def prepare_statements(dbapi_connection, connection_record):
+    """在新建的数据库连接上预处理热点 SQL"""
+    with dbapi_connection.cursor() as cursor:
+        for name, statement in PREPARED_STATEMENTS.items():
+            # PREPARE 使用 $1, $2 ... 形式的参数
+            position = count(1)
+            statement = re.sub(r'%s', lambda m: f'${next(position)}', statement)
+            cursor.execute(f'PREPARE {name} AS {statement}')
+    
+    dbapi_connection.commit()
+    logger.debug(f"已预处理 {len(PREPARED_STATEMENTS)} 条热点 SQL")
+
+def execute_statement(cursor, name, params):
+    """执行热点 SQL（启用预处理时使用 EXECUTE）"""
+    if config.DB_PREPARE_STATEMENTS:
+        placeholders = ', '.join(['%s'] * len(params))
+        cursor.execute(f'EXECUTE {name} ({placeholders})', params)
+    else:
+        cursor.execute(PREPARED_STATEMENTS[name], params)
+
+# psycopg2 是 C 扩展，不受猴子补丁影响；通过等待回调让查询等待期间让出协程
+if GEVENT_ENABLED:
+    import psycopg2.extensions
+    import psycopg2.extras
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
 
 # 初始化配置
 config = Config()
 
+# 在代理之后 remote_addr 是代理的 IP，所有客户端会共用同一个限流桶
+if config.TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.TRUSTED_PROXY_COUNT)
+
 # 全局变量
 app_start_time = time.time()
 last_webhook_time = None
@@ -100,17 +222,21 @@ webhook_count = 0
 RATE_LIMITS = {
     'default': {'limit': 60, 'window': 60},  # 每分钟60个请求
     'verify': {'limit': 30, 'window': 60},    # 验证端点限制更严格
-    'webhook': {'limit': 10, 'window': 60},   # Webhook限制
+    'webhook': {'limit': 120, 'window': 60},  # Webhook限制（Gumroad 会重试，留足余量）
     'admin': {'limit': 100, 'window': 60}     # 管理端点宽松一些
 }
 
-# 存储请求记录
+# 令牌桶状态: (限制类型, 客户端IP) -> [剩余令牌数, 上次更新时间]
 request_store = {}
 request_store_lock = threading.Lock()
+RATE_LIMIT_SWEEP_INTERVAL = 60  # 清理已回满令牌桶的最短间隔（秒）
+request_store_last_sweep = 0
 
-# 内存缓存
+# 内存缓存（dict 按写入顺序排列，最早写入的条目在最前面）
 cache_store = {}
 cache_lock = threading.Lock()
+CACHE_SWEEP_INTERVAL = 60  # 写入时顺带清理过期缓存的最短间隔（秒）
+cache_last_sweep = 0
 
 def get_cache(key):
     """获取缓存"""
@@ -133,15 +259,29 @@ def get_cache(key):
 
 def set_cache(key, value, ttl=None):
     """设置缓存"""
+    global cache_last_sweep
+    
     if not config.CACHE_ENABLED:
         return False
     
     with cache_lock:
         ttl = ttl or config.CACHE_TTL
+        current_time = time.time()
+        
+        # 过期缓存只偶尔全量清理，避免缓存已满时每次写入都扫描整个字典
+        if current_time - cache_last_sweep >= CACHE_SWEEP_INTERVAL:
+            purge_expired_cache(current_time)
+            cache_last_sweep = current_time
+        
+        # 重新写入的键移到末尾；已满时 O(1) 淘汰最早写入的条目
+        cache_store.pop(key, None)
+        if len(cache_store) >= config.CACHE_MAX_ENTRIES:
+            del cache_store[next(iter(cache_store))]
+        
         cache_store[key] = {
             'value': value,
-            'expires_at': time.time() + ttl,
-            'created_at': time.time()
+            'expires_at': current_time + ttl,
+            'created_at': current_time
         }
         logger.debug(f"缓存设置: {key}, TTL: {ttl}s")
         return True
@@ -170,18 +310,21 @@ def cleanup_cache():
         return
     
     with cache_lock:
-        expired_keys = []
-        current_time = time.time()
-        
-        for key, cached_data in cache_store.items():
-            if current_time >= cached_data['expires_at']:
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del cache_store[key]
-        
-        if expired_keys:
-            logger.debug(f"清理过期缓存: {len(expired_keys)} 个")
+        purge_expired_cache(time.time())
+
+def purge_expired_cache(current_time):
+    """删除已过期的缓存条目（调用方须持有 cache_lock）"""
+    expired_keys = []
+    
+    for key, cached_data in cache_store.items():
+        if current_time >= cached_data['expires_at']:
+            expired_keys.append(key)
+    
+    for key in expired_keys:
+        del cache_store[key]
+    
+    if expired_keys:
+        logger.debug(f"清理过期缓存: {len(expired_keys)} 个")
 
 # 日志统计数据
 request_stats = {
@@ -344,36 +487,37 @@ def reset_request_stats():
         }
     logger.info("📊 请求统计数据已重置")
 
+@lru_cache(maxsize=1)
+def get_cipher():
+    """获取 Fernet 加密器（每个进程只构造一次，可在线程间共享）"""
+    encryption_key = config.ENCRYPTION_KEY
+    
+    # 确保密钥是字节串
+    if isinstance(encryption_key, str):
+        encryption_key = encryption_key.encode('utf-8')
+    
+    # 如果密钥不是有效的 base64，尝试修复
+    if len(encryption_key) != 44 or not encryption_key.endswith(b'='):
+        logger.warning("⚠️  加密密钥格式可能不正确，尝试修复...")
+        # 补齐/截断到32字节后再做 base64 编码
+        encryption_key = base64.urlsafe_b64encode(encryption_key.ljust(32)[:32])
+    
+    return Fernet(encryption_key)
+
 def init_professional_components():
     """初始化专业组件"""
     try:
         # 初始化激活码生成器
-        encryption_key = config.ENCRYPTION_KEY
-        if not encryption_key:
+        if not config.ENCRYPTION_KEY:
             logger.warning("⚠️  ENCRYPTION_KEY 未配置，将使用简单激活码")
             cipher = None
         else:
-            # 确保密钥是字符串
-            if isinstance(encryption_key, bytes):
-                encryption_key = encryption_key.decode('utf-8')
-            
-            # 如果密钥不是有效的 base64，尝试修复
-            if len(encryption_key) != 44 or '=' not in encryption_key[-1:]:
-                logger.warning("⚠️  加密密钥格式可能不正确，尝试修复...")
-                # 尝试 base64 编码
-                try:
-                    # 如果已经是字符串，先编码再解码
-                    if isinstance(encryption_key, str):
-                        encryption_key = base64.urlsafe_b64encode(encryption_key.encode()).decode()
-                except:
-                    logger.error("❌ 无法修复加密密钥，将使用简单激活码")
-                    cipher = None
-                else:
-                    cipher = Fernet(encryption_key)
-            else:
-                cipher = Fernet(encryption_key)
-            
-            logger.info("✅ 加密组件初始化完成")
+            try:
+                cipher = get_cipher()
+                logger.info("✅ 加密组件初始化完成")
+            except Exception as e:
+                logger.error(f"❌ 无法修复加密密钥，将使用简单激活码: {e}")
+                cipher = None
         
         # 初始化邮件发送器配置
         smtp_configured = all([
@@ -396,14 +540,64 @@ def init_professional_components():
 # 初始化专业组件
 cipher, smtp_configured = init_professional_components()
 
+def create_db_engine(database_url):
+    """创建数据库引擎（连接池参数按 PgBouncer 事务模式调优）"""
+    url = make_url(database_url)
+    
+    # 显式指定 psycopg2 驱动（SQLAlchemy 也不再识别 Render 提供的 postgres:// 前缀）
+    if url.get_backend_name() in ('postgres', 'postgresql'):
+        url = url.set(drivername='postgresql+psycopg2')
+    
+    # SQL 使用了 %s 占位符、JSONB、ON CONFLICT 等 PostgreSQL 语法，其他数据库（如 sqlite）
+    # 会在运行时才失败；这里提前拒绝，由调用方降级到文件存储
+    backend = url.get_backend_name()
+    if backend != 'postgresql':
+        raise ValueError(f"仅支持 PostgreSQL 数据库，当前为: {backend}")
+    
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=10,         # 常驻连接数
+        max_overflow=5,       # 高峰期额外连接数
+        pool_recycle=60,      # 60秒回收连接，避免被 PgBouncer 关闭的陈旧连接
+        pool_pre_ping=False   # 不做 SELECT 1 探测，避免后端停留在 idle in transaction
+    )
+    
+    if config.DB_PREPARE_STATEMENTS:
+        event.listen(engine, 'connect', prepare_statements)
+        logger.info("✅ 已启用热点 SQL 预处理")
+    
+    return engine
+
 def safe_init_database():
-    """安全地初始化数据库"""
-    global db_pool
+    """初始化数据库连接池
+    
+    只创建连接池，不连接数据库、不执行 DDL；表结构由部署时的
+    ``python activation_server.py migrate`` 创建，避免每个 worker 启动时重复执行。
+    """
+    global db_engine
     
     if not config.DATABASE_URL:
         logger.info("💾 使用本地文件存储（未配置数据库）")
         return False
     
+    try:
+        # 初始化连接池（不会立即建立连接）
+        db_engine = create_db_engine(config.DATABASE_URL)
+        logger.info("✅ 数据库连接池初始化成功")
+        return True
+    except Exception as pool_error:
+        logger.error(f"❌ 连接池初始化失败: {pool_error}")
+        logger.warning("💾 降级到本地文件存储")
+        return False
+
+def migrate_database():
+    """创建/更新数据库表结构（部署时执行一次）"""
+    if not config.DATABASE_URL:
+        # 文件存储模式无需建表，部署时的 migrate 步骤应直接成功
+        logger.info("💾 未配置 DATABASE_URL，使用本地文件存储，跳过数据库初始化")
+        return True
+    
     try:
         # 尝试导入数据库模块
         from database.init_db import init_database
@@ -413,32 +607,15 @@ def safe_init_database():
         
         if success:
             logger.info("✅ 数据库初始化成功")
-            
-            # 初始化连接池
-            try:
-                db_pool = pool.ThreadedConnectionPool(
-                    minconn=2,  # 最小连接数
-                    maxconn=10,  # 最大连接数
-                    dsn=config.DATABASE_URL
-                )
-                logger.info("✅ 数据库连接池初始化成功")
-            except Exception as pool_error:
-                logger.error(f"❌ 连接池初始化失败: {pool_error}")
-                logger.warning("⚠️  降级到单连接模式")
-                db_pool = None
-            
-            return True
         else:
-            logger.warning("⚠️  数据库初始化失败，降级到文件存储")
-            return False
+            logger.warning("⚠️  数据库初始化失败")
+        return success
             
     except ImportError as e:
         logger.warning(f"⚠️  无法导入数据库模块: {e}")
-        logger.warning("💾 降级到本地文件存储")
         return False
     except Exception as e:
         logger.error(f"❌ 数据库初始化异常: {e}")
-        logger.warning("💾 降级到本地文件存储")
         return False
 
 # 初始化数据库
@@ -468,6 +645,34 @@ def parse_form_data(data):
         logger.error(f"解析 form-data 失败: {e}")
         return {}
 
+# Fernet 令牌以版本字节 0x80 和时间戳高位开头，base64 后固定为该前缀
+FERNET_TOKEN_PREFIX = 'gAAAAA'
+
+def format_activation_code(activation_code):
+    """将 Fernet 激活码格式化为易读格式（8位一组，用 - 连接），仅在展示时调用"""
+    if not activation_code.startswith(FERNET_TOKEN_PREFIX):
+        return activation_code
+    return '-'.join([
+        activation_code[i:i+8]
+        for i in range(0, len(activation_code), 8)
+    ])
+
+def normalize_activation_code(activation_code):
+    """将激活码还原为数据库中存储的规范形式
+    
+    - 专业激活码（Fernet 令牌）: 去掉格式化时插入的分隔符，还原为原始令牌（区分大小写）
+    - 简单激活码: 去掉所有 -，统一转为大写（生成时即为大写）
+    """
+    code_clean = ''.join(activation_code.split())
+    
+    if code_clean.startswith(FERNET_TOKEN_PREFIX):
+        # Fernet 令牌本身可能包含 -，只去掉 format_activation_code 每8位插入的分隔符
+        if len(code_clean) > 8 and all(c == '-' for c in code_clean[8::9]):
+            return ''.join(code_clean[i:i+8] for i in range(0, len(code_clean), 9))
+        return code_clean
+    
+    return code_clean.replace('-', '').upper()
+
 def require_api_key(f):
     """API密钥验证装饰器"""
     @wraps(f)
@@ -480,59 +685,54 @@ def require_api_key(f):
     return decorated_function
 
 def rate_limit(limit_type='default'):
-    """API速率限制装饰器"""
+    """API速率限制装饰器（令牌桶，每次请求 O(1)）"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            global request_store
+            global request_store_last_sweep
             
             # 获取客户端IP
             client_ip = request.remote_addr
             
-            # 获取限制配置
+            # 获取限制配置：桶容量为 limit，每秒补充 limit / window 个令牌
             limit_config = RATE_LIMITS.get(limit_type, RATE_LIMITS['default'])
             limit = limit_config['limit']
             window = limit_config['window']
+            refill_rate = limit / window
             
-            # 清理过期记录并检查限制
             current_time = time.time()
+            key = (limit_type, client_ip)
             
             with request_store_lock:
-                # 确保客户端IP的记录存在
-                if client_ip not in request_store:
-                    request_store[client_ip] = []
+                # 按时间间隔清理已回满的桶（防止内存泄漏），回满的桶与新建的桶等价；
+                # 不随新 IP 触发，避免轮换 IP 的客户端让每个请求都全量扫描
+                if current_time - request_store_last_sweep >= RATE_LIMIT_SWEEP_INTERVAL:
+                    for stale_key in [k for k, (_, last) in request_store.items()
+                                      if current_time - last >= RATE_LIMITS.get(k[0], RATE_LIMITS['default'])['window']]:
+                        del request_store[stale_key]
+                    request_store_last_sweep = current_time
+                
+                bucket = request_store.get(key)
+                if bucket is None:
+                    bucket = request_store[key] = [float(limit), current_time]
                 
-                # 清理过期的请求记录
-                request_store[client_ip] = [
-                    timestamp for timestamp in request_store[client_ip]
-                    if current_time - timestamp < window
-                ]
+                # 按流逝时间补充令牌
+                tokens = min(limit, bucket[0] + (current_time - bucket[1]) * refill_rate)
+                bucket[1] = current_time
                 
                 # 检查是否超过限制
-                if len(request_store[client_ip]) >= limit:
+                if tokens < 1:
+                    bucket[0] = tokens
                     logger.warning(f"速率限制触发: {client_ip}, 类型: {limit_type}")
                     return jsonify({
                         "error": "请求过于频繁，请稍后再试",
                         "limit": limit,
                         "window": window,
-                        "retry_after": int(window - (current_time - min(request_store[client_ip])) + 1)
+                        "retry_after": int((1 - tokens) / refill_rate) + 1
                     }), 429
                 
-                # 记录新请求
-                request_store[client_ip].append(current_time)
-                
-                # 定期清理过期数据（防止内存泄漏）
-                if len(request_store) > 1000:  # 当IP数量超过1000时清理
-                    expired_ips = []
-                    for ip, timestamps in request_store.items():
-                        filtered = [t for t in timestamps if current_time - t < window]
-                        if not filtered:
-                            expired_ips.append(ip)
-                        else:
-                            request_store[ip] = filtered
-                    
-                    for ip in expired_ips:
-                        del request_store[ip]
+                # 消耗一个令牌
+                bucket[0] = tokens - 1
             
             return f(*args, **kwargs)
         return decorated_function
@@ -545,7 +745,7 @@ def validate_request(content_types=None):
         def decorated_function(*args, **kwargs):
             # 验证Content-Type
             if content_types:
-                content_type = request.content_type
+                content_type = request.content_type or ''
                 if not any(ct in content_type for ct in content_types):
                     return jsonify({
                         "error": f"不支持的Content-Type",
@@ -581,40 +781,20 @@ def validate_request(content_types=None):
         return decorated_function
     return decorator
 
-def get_db_connection():
-    """获取数据库连接"""
-    global db_pool
+@contextmanager
+def get_conn():
+    """从连接池借出数据库连接，退出时自动归还"""
+    global db_engine
     
-    try:
-        # 优先使用连接池
-        if db_pool:
-            conn = db_pool.getconn()
-            logger.debug("从连接池获取连接")
-            return conn
-        else:
-            # 回退到直接连接
-            logger.warning("连接池不可用，使用直接连接")
-            import psycopg2
-            return psycopg2.connect(config.DATABASE_URL)
-    except Exception as e:
-        logger.error(f"获取数据库连接失败: {e}")
-        # 再次尝试直接连接
-        import psycopg2
-        return psycopg2.connect(config.DATABASE_URL)
-
-def put_db_connection(conn):
-    """归还数据库连接"""
-    global db_pool
+    if db_engine is None:
+        db_engine = create_db_engine(config.DATABASE_URL)
     
+    # raw_connection() 返回 psycopg2 连接的代理，close() 会把连接归还到连接池
+    # 并回滚未提交的事务
+    conn = db_engine.raw_connection()
     try:
-        if db_pool:
-            db_pool.putconn(conn)
-            logger.debug("连接归还到连接池")
-        else:
-            conn.close()
-    except Exception as e:
-        logger.error(f"归还连接失败: {e}")
-        # 如果是直接连接，手动关闭
+        yield conn
+    finally:
         conn.close()
 
 def error_response(code, message, details=None, request_id=None):
@@ -676,30 +856,44 @@ def generate_professional_activation_code(email, product_type="personal",
         ).hexdigest()[:8]
         activation_data['checksum'] = checksum
         
-        # 加密
-        data_str = json.dumps(activation_data, separators=(',', ':'))
-        encrypted = cipher.encrypt(data_str.encode())
+        # 加密（Fernet 令牌本身就是 URL 安全的 base64 文本，无需再编码）
+        activation_code = cipher.encrypt(orjson.dumps(activation_data)).decode('ascii')
         
-        # Base64编码
-        activation_code = base64.urlsafe_b64encode(encrypted).decode()
-        
-        # 格式化为易读格式 (8位一组)
-        formatted_code = '-'.join([
-            activation_code[i:i+8] 
-            for i in range(0, min(len(activation_code), 48), 8)
-        ])
-        
-        # 确保不超过59字符
-        if len(formatted_code) > 59:
-            formatted_code = formatted_code[:59]
-        
-        logger.info(f"🔐 生成专业激活码: {formatted_code[:20]}...")
-        return formatted_code, activation_data
+        # 内部只传递原始令牌，带 - 的易读格式在邮件/响应展示时再生成
+        logger.info(f"🔐 生成专业激活码: {activation_code[:20]}...")
+        return activation_code, activation_data
         
     except Exception as e:
         logger.error(f"❌ 生成专业激活码失败: {e}")
         return generate_simple_activation_code(email, product_type)
 
+# 专业激活码的最长有效期（企业版3年），用作 Fernet 令牌的 TTL 上限
+MAX_ACTIVATION_TTL = 365 * 3 * 24 * 3600
+
+def check_activation_token(activation_code):
+    """在访问数据库前本地校验专业激活码（Fernet 令牌）
+    
+    只需 CPU 即可拒绝被篡改、格式错误或已过期的令牌。
+    返回错误信息；令牌有效或无法本地校验（简单激活码、未启用加密）时返回 None。
+    """
+    if not cipher or not activation_code.startswith(FERNET_TOKEN_PREFIX):
+        return None
+    
+    try:
+        # 超过最长有效期的令牌在校验签名和解密之前就会被拒绝
+        decrypted = cipher.decrypt(activation_code.encode(), ttl=MAX_ACTIVATION_TTL)
+        activation_data = orjson.loads(decrypted)
+        valid_until = datetime.fromisoformat(activation_data['valid_until'])
+    except InvalidToken:
+        return "激活码无效或已过期"
+    except (ValueError, KeyError, TypeError):
+        return "激活码无效"
+    
+    if datetime.now() > valid_until:
+        return "激活码已过期"
+    
+    return None
+
 def generate_simple_activation_code(email, product_type="personal"):
     """生成简单的激活码"""
     import secrets
@@ -751,6 +945,61 @@ def generate_simple_activation_code(email, product_type="personal"):
     
     return activation_code, activation_data
 
+# 复用已登录的 SMTP 连接，避免每封邮件都重新握手 TLS 和认证
+smtp_connection = None
+smtp_lock = threading.Lock()
+
+def open_smtp_connection():
+    """建立并登录 SMTP 连接"""
+    server = smtplib.SMTP(config.SMTP_HOST, int(config.SMTP_PORT), timeout=config.REQUEST_TIMEOUT)
+    try:
+        server.starttls()  # Enable secure connection
+        server.login(config.SMTP_USER, config.SMTP_PASSWORD)
+    except Exception:
+        # 握手或认证失败时关闭已建立的 socket，避免每次重试都泄漏一个连接
+        server.close()
+        raise
+    logger.info(f"🔗 SMTP 连接已建立: {config.SMTP_HOST}")
+    return server
+
+def close_smtp_connection():
+    """关闭当前 SMTP 连接"""
+    global smtp_connection
+    
+    if smtp_connection is None:
+        return
+    
+    try:
+        smtp_connection.quit()
+    except Exception:
+        smtp_connection.close()
+    smtp_connection = None
+
+def send_smtp_message(msg):
+    """通过复用的 SMTP 连接发送邮件，连接失效时自动重连"""
+    global smtp_connection
+    
+    with smtp_lock:
+        # 检测空闲期间被服务器断开的连接
+        if smtp_connection is not None:
+            try:
+                status = smtp_connection.noop()[0]
+            except (smtplib.SMTPException, OSError):
+                status = None
+            if status != 250:
+                close_smtp_connection()
+        
+        if smtp_connection is None:
+            smtp_connection = open_smtp_connection()
+        
+        try:
+            smtp_connection.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # noop 之后仍被断开，重连后再试一次
+            close_smtp_connection()
+            smtp_connection = open_smtp_connection()
+            smtp_connection.send_message(msg)
+
 def send_activation_email(email, activation_code, activation_data):
     """Send activation email"""
     
@@ -763,6 +1012,9 @@ def send_activation_email(email, activation_code, activation_data):
         return False
     
     try:
+        # 邮件中展示易读格式，粘贴回来时 normalize_activation_code 会去掉分隔符
+        activation_code = format_activation_code(activation_code)
+        
         # Extract information from activation data
         product_type = activation_data.get('product_type', 'personal').capitalize()
         valid_until = activation_data.get('valid_until', '')[:10]
@@ -900,10 +1152,7 @@ This email is automatically sent, please do not reply directly.
         # Connect to SMTP server and send
         logger.info(f"📤 Sending email to: {email}")
         
-        with smtplib.SMTP(config.SMTP_HOST, int(config.SMTP_PORT)) as server:
-            server.starttls()  # Enable secure connection
-            server.login(config.SMTP_USER, config.SMTP_PASSWORD)
-            server.send_message(msg)
+        send_smtp_message(msg)
         
         logger.info(f"✅ Activation email successfully sent to: {email}")
         return True
@@ -930,30 +1179,19 @@ def save_activation_record(email, activation_code, activation_data):
 def save_to_database(email, activation_code, activation_data):
     """保存到数据库"""
     try:
-        import psycopg2
-        import psycopg2.extras
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        INSERT INTO activations 
-        (email, activation_code, product_type, days_valid, max_devices, valid_until, metadata)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (activation_code) DO NOTHING
-        ''', (
-            email,
-            activation_code,
-            activation_data['product_type'],
-            activation_data['days_valid'],
-            activation_data['max_devices'],
-            activation_data['valid_until'],
-            json.dumps(activation_data)
-        ))
-        
-        conn.commit()
-        cursor.close()
-        put_db_connection(conn)
+        with get_conn() as conn:
+            with conn.cursor() as cursor:
+                execute_statement(cursor, 'activation_insert', (
+                    email,
+                    normalize_activation_code(activation_code),
+                    activation_data['product_type'],
+                    activation_data['days_valid'],
+                    activation_data['max_devices'],
+                    activation_data['valid_until'],
+                    orjson.dumps(activation_data).decode()
+                ))
+            
+            conn.commit()
         
         logger.info(f"💾 激活码保存到数据库: {activation_code[:20]}...")
         return True
@@ -965,80 +1203,36 @@ def save_to_database(email, activation_code, activation_data):
 def verify_from_database(activation_code, device_id, device_name):
     """从数据库验证激活码"""
     try:
-        import psycopg2
         import psycopg2.extras
         
-        # 清理激活码格式
-        activation_code = activation_code.replace('-', '').replace(' ', '').lower()
-        
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # 查询激活码
-        cursor.execute('''
-        SELECT * FROM activations WHERE activation_code = %s
-        ''', (activation_code,))
-        
-        activation = cursor.fetchone()
-        
-        if not activation:
-            cursor.close()
-            put_db_connection(conn)
-            return False, "激活码不存在", {}
-        
-        # 检查是否过期
-        valid_until = activation['valid_until']
-        if datetime.now() > valid_until:
-            cursor.close()
-            put_db_connection(conn)
-            return False, "激活码已过期", {}
-        
-        # 检查设备限制
-        cursor.execute('''
-        SELECT COUNT(*) as device_count 
-        FROM device_activations 
-        WHERE activation_id = %s AND is_active = TRUE
-        ''', (activation['id'],))
-        
-        device_count = cursor.fetchone()['device_count']
-        
-        if device_count >= activation['max_devices']:
-            cursor.close()
-            put_db_connection(conn)
-            return False, f"已达到最大设备数限制 ({activation['max_devices']} 台)", {}
-        
-        # 检查设备是否已激活
-        cursor.execute('''
-        SELECT * FROM device_activations 
-        WHERE activation_id = %s AND device_id = %s
-        ''', (activation['id'], device_id))
-        
-        existing_device = cursor.fetchone()
-        
-        if existing_device:
-            # 更新现有设备激活
-            cursor.execute('''
-            UPDATE device_activations 
-            SET last_used = CURRENT_TIMESTAMP, is_active = TRUE
-            WHERE id = %s
-            ''', (existing_device['id'],))
-        else:
-            # 创建新设备激活
-            cursor.execute('''
-            INSERT INTO device_activations (activation_id, device_id, device_name)
-            VALUES (%s, %s, %s)
-            ''', (activation['id'], device_id, device_name))
-        
-        # 更新激活码状态
-        cursor.execute('''
-        UPDATE activations 
-        SET is_used = TRUE, used_at = CURRENT_TIMESTAMP, used_by_device = %s
-        WHERE id = %s
-        ''', (device_id, activation['id']))
-        
-        conn.commit()
-        cursor.close()
-        put_db_connection(conn)
+        # 统一为规范形式，与 save_to_database 存储的格式一致
+        activation_code = normalize_activation_code(activation_code)
+        
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                # 一次往返同时查出激活码、已激活设备数和当前设备状态
+                execute_statement(cursor, 'verify_lookup', (activation_code, device_id))
+                
+                activation = cursor.fetchone()
+                
+                if not activation:
+                    return False, "激活码不存在", {}
+                
+                # 检查是否过期
+                valid_until = activation['valid_until']
+                if datetime.now() > valid_until:
+                    return False, "激活码已过期", {}
+                
+                # 检查设备限制（已激活的设备再次验证不占用新名额）
+                if (not activation['device_is_active']
+                        and activation['device_count'] >= activation['max_devices']):
+                    return False, f"已达到最大设备数限制 ({activation['max_devices']} 台)", {}
+                
+                # 登记设备激活并更新激活码状态（一条语句完成）
+                execute_statement(cursor, 'verify_activate',
+                                  (activation['id'], device_id, device_name, device_id))
+            
+            conn.commit()
         
         # 计算剩余天数
         days_remaining = (valid_until - datetime.now()).days
@@ -1210,6 +1404,137 @@ def save_to_file(email, activation_code, activation_data):
         logger.error(f"文件保存失败: {e}")
         return False
 
+# ==================== 邮件发送队列 ====================
+# Webhook 只负责生成和保存激活码，邮件由后台线程发送，
+# 避免 Gumroad 等待 SMTP 超时后重试
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_INTERVAL = 60        # 每隔多久检查一次到期的待发送邮件（秒）
+EMAIL_RETRY_BASE_DELAY = 60      # 重试退避基数（秒），第 n 次失败后等待 60 * 2^(n-1) 秒
+EMAIL_RETRY_MAX_DELAY = 3600     # 单次退避的上限（秒）
+
+email_queue = queue.Queue()
+# 后台线程正在发送的邮件，进程退出时与队列中剩余的邮件一起保存
+email_in_flight = None
+
+def enqueue_activation_email(email, activation_code, activation_data, attempts=0):
+    """将激活邮件加入后台发送队列"""
+    email_queue.put((email, activation_code, activation_data, attempts))
+    logger.info(f"📬 激活邮件已加入发送队列: {email} (队列长度: {email_queue.qsize()})")
+
+def save_pending_email(email, activation_code, activation_data, attempts):
+    """保存未发送的邮件到数据库，到达退避时间后由后台线程重新发送"""
+    if not config.DATABASE_URL:
+        logger.warning(f"⚠️  未配置数据库，无法保存待发送邮件: {email}")
+        return False
+    
+    # 尚未失败过的邮件（进程退出时保存的）立即可重试，失败过的按指数退避
+    delay = 0
+    if attempts > 0:
+        delay = min(EMAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1), EMAIL_RETRY_MAX_DELAY)
+    
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                INSERT INTO pending_emails (email, activation_code, activation_data, attempts, next_attempt_at)
+                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                ''', (email, activation_code, orjson.dumps(activation_data).decode(), attempts, delay))
+            
+            conn.commit()
+        
+        if attempts >= EMAIL_MAX_ATTEMPTS:
+            logger.error(f"❌ 邮件已达最大重试次数，停止发送: {email} (已尝试 {attempts} 次)")
+        else:
+            logger.info(f"💾 待发送邮件已保存: {email} (已尝试 {attempts} 次，{delay} 秒后重试)")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 保存待发送邮件失败: {e}")
+        return False
+
+def load_pending_emails():
+    """取回数据库中已到重试时间的待发送邮件并重新加入队列"""
+    if not config.DATABASE_URL:
+        return 0
+    
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cursor:
+                # DELETE ... RETURNING 保证多个 worker 同时读取时每封邮件只被一个 worker 取走
+                cursor.execute('''
+                DELETE FROM pending_emails
+                WHERE attempts < %s AND next_attempt_at <= CURRENT_TIMESTAMP
+                RETURNING email, activation_code, activation_data, attempts
+                ''', (EMAIL_MAX_ATTEMPTS,))
+                
+                pending = cursor.fetchall()
+            
+            conn.commit()
+        
+        for email, activation_code, activation_data, attempts in pending:
+            enqueue_activation_email(email, activation_code, activation_data, attempts)
+        
+        if pending:
+            logger.info(f"📬 重新加入发送队列的待发送邮件: {len(pending)} 封")
+        return len(pending)
+        
+    except Exception as e:
+        logger.error(f"❌ 读取待发送邮件失败: {e}")
+        return 0
+
+def email_worker():
+    """后台邮件发送线程（每 EMAIL_RETRY_INTERVAL 秒重新取回到期的待发送邮件）"""
+    global email_in_flight
+    
+    next_reload = 0
+    
+    while True:
+        if time.time() >= next_reload:
+            load_pending_emails()
+            next_reload = time.time() + EMAIL_RETRY_INTERVAL
+        
+        try:
+            item = email_queue.get(timeout=max(next_reload - time.time(), 0))
+        except queue.Empty:
+            continue
+        
+        email, activation_code, activation_data, attempts = item
+        email_in_flight = item
+        try:
+            if not send_activation_email(email, activation_code, activation_data):
+                save_pending_email(email, activation_code, activation_data, attempts + 1)
+        except Exception as e:
+            logger.error(f"❌ 后台发送邮件异常: {e}")
+            save_pending_email(email, activation_code, activation_data, attempts + 1)
+        finally:
+            email_in_flight = None
+            email_queue.task_done()
+
+@atexit.register
+def flush_email_queue():
+    """进程退出时保存正在发送和队列中尚未发送的邮件"""
+    # 正在发送的邮件可能已经送达，宁可重复发送也不丢失
+    item = email_in_flight
+    if item is not None:
+        save_pending_email(*item)
+    
+    while True:
+        try:
+            email, activation_code, activation_data, attempts = email_queue.get_nowait()
+        except queue.Empty:
+            break
+        save_pending_email(email, activation_code, activation_data, attempts)
+
+def start_email_worker():
+    """启动邮件发送线程"""
+    email_thread = threading.Thread(target=email_worker, name='email-worker', daemon=True)
+    email_thread.start()
+    return email_thread
+
+# gunicorn 等导入本模块时启动邮件发送线程；直接运行时由 __main__ 决定
+if __name__ != '__main__':
+    start_email_worker()
+
 # ==================== 心跳保持 ====================
 def keep_service_awake():
     """定时访问服务防止休眠"""
@@ -1269,9 +1594,9 @@ def health_check():
         db_status = "未配置"
         if config.DATABASE_URL:
             try:
-                import psycopg2
-                conn = psycopg2.connect(config.DATABASE_URL)
-                conn.close()
+                with get_conn() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute('SELECT 1')
                 db_status = "连接正常"
             except Exception as e:
                 logger.error(f"数据库连接失败: {e}")
@@ -1309,8 +1634,8 @@ def health_check():
             "timestamp": datetime.now().isoformat()
         }), 500
 
-@rate_limit('default')
 @app.route('/api/status', methods=['GET'])
+@rate_limit('default')
 def server_status():
     """服务器实时状态"""
     try:
@@ -1349,9 +1674,9 @@ def server_status():
         return jsonify({"error": str(e)}), 500
 
 # ==================== Gumroad Webhook 处理 ====================
+@app.route('/api/webhook/gumroad', methods=['POST'])
 @rate_limit('webhook')
 @validate_request(['application/json', 'application/x-www-form-urlencoded'])
-@app.route('/api/webhook/gumroad', methods=['POST'])
 def webhook_gumroad():
     """处理Gumroad Webhook - 支持 form-urlencoded 格式"""
     global last_webhook_time, webhook_count
@@ -1448,42 +1773,17 @@ def webhook_gumroad():
         # 保存购买记录到 purchases 表
         try:
             if config.DATABASE_URL:
-                import psycopg2
-                
-                conn = psycopg2.connect(config.DATABASE_URL)
-                cursor = conn.cursor()
-                
-                # 确保 purchases 表存在
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS purchases (
-                    id SERIAL PRIMARY KEY,
-                    purchase_id VARCHAR(255) UNIQUE,
-                    email VARCHAR(255),
-                    product_name VARCHAR(255),
-                    gumroad_data JSONB,
-                    processed BOOLEAN DEFAULT FALSE,
-                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                ''')
-                
-                # 插入购买记录
-                cursor.execute('''
-                INSERT INTO purchases (purchase_id, email, product_name, gumroad_data, processed)
-                VALUES (%s, %s, %s, %s, TRUE)
-                ON CONFLICT (purchase_id) 
-                DO UPDATE SET 
-                    processed = TRUE,
-                    processed_at = CURRENT_TIMESTAMP
-                ''', (
-                    purchase_id,
-                    email,
-                    product_name,
-                    json.dumps(data)
-                ))
-                
-                conn.commit()
-                conn.close()
+                with get_conn() as conn:
+                    with conn.cursor() as cursor:
+                        # 插入购买记录（purchases 表由 migrate 命令创建）
+                        execute_statement(cursor, 'purchase_upsert', (
+                            purchase_id,
+                            email,
+                            product_name,
+                            orjson.dumps(data).decode()
+                        ))
+                    
+                    conn.commit()
                 logger.info(f"💾 购买记录保存成功: {purchase_id}")
                 
         except Exception as db_error:
@@ -1493,11 +1793,11 @@ def webhook_gumroad():
         # 保存激活记录
         save_success = save_activation_record(email, activation_code, activation_data)
         
-        # 发送邮件
-        email_sent = False
+        # 邮件交给后台线程发送，立即响应 Gumroad
+        email_queued = False
         if activation_code:
-            logger.info(f"📤 准备发送邮件到: {email}")
-            email_sent = send_activation_email(email, activation_code, activation_data)
+            enqueue_activation_email(email, activation_code, activation_data)
+            email_queued = True
         
         # 记录处理结果
         logger.info("=" * 60)
@@ -1505,17 +1805,17 @@ def webhook_gumroad():
         logger.info(f"   📧 邮箱: {email}")
         logger.info(f"   🏷️  产品: {product_name}")
         logger.info(f"   🔑 激活码: {activation_code[:20]}...")
-        logger.info(f"   📤 邮件状态: {'✅ 已发送' if email_sent else '❌ 发送失败'}")
+        logger.info(f"   📤 邮件状态: {'📬 已加入发送队列' if email_queued else '❌ 未发送'}")
         logger.info(f"   💾 保存状态: {'✅ 成功' if save_success else '❌ 失败'}")
         logger.info("=" * 60)
         
         return jsonify({
             "success": True,
-            "message": "激活码已生成" + ("并发送" if email_sent else "（但邮件发送失败）"),
-            "activation_code": activation_code,
+            "message": "激活码已生成" + ("，邮件发送中" if email_queued else "（但邮件未发送）"),
+            "activation_code": format_activation_code(activation_code),
             "email": email,
             "product_type": product_type,
-            "email_sent": email_sent,
+            "email_queued": email_queued,
             "save_success": save_success
         })
         
@@ -1574,29 +1874,24 @@ def check_purchase(sale_id):
                 "note": "无法检查购买记录"
             })
         
-        import psycopg2
         import psycopg2.extras
         
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # 检查 purchases 表
-        cursor.execute('''
-        SELECT * FROM purchases WHERE purchase_id = %s
-        ''', (sale_id,))
-        purchase = cursor.fetchone()
-        
-        # 检查 activations 表
-        cursor.execute('''
-        SELECT email, activation_code, product_type, generated_at, metadata 
-        FROM activations 
-        WHERE metadata::jsonb->>'purchase_id' = %s 
-           OR metadata::jsonb->>'sale_id' = %s
-        ''', (sale_id, sale_id))
-        activation = cursor.fetchone()
-        
-        cursor.close()
-        put_db_connection(conn)
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                # 检查 purchases 表
+                cursor.execute('''
+                SELECT * FROM purchases WHERE purchase_id = %s
+                ''', (sale_id,))
+                purchase = cursor.fetchone()
+                
+                # 检查 activations 表
+                cursor.execute('''
+                SELECT email, activation_code, product_type, generated_at, metadata 
+                FROM activations 
+                WHERE metadata::jsonb->>'purchase_id' = %s 
+                   OR metadata::jsonb->>'sale_id' = %s
+                ''', (sale_id, sale_id))
+                activation = cursor.fetchone()
         
         return jsonify({
             "sale_id": sale_id,
@@ -1621,19 +1916,15 @@ def check_activation(activation_code):
                 "activation_code": activation_code
             })
         
-        import psycopg2
         import psycopg2.extras
         
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cursor.execute('''
-        SELECT * FROM activations WHERE activation_code = %s
-        ''', (activation_code,))
-        
-        activation = cursor.fetchone()
-        cursor.close()
-        put_db_connection(conn)
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute('''
+                SELECT * FROM activations WHERE activation_code = %s
+                ''', (normalize_activation_code(activation_code),))
+                
+                activation = cursor.fetchone()
         
         if activation:
             return jsonify({
@@ -1662,33 +1953,30 @@ def list_purchases():
                 "note": "使用文件存储，无法列出购买记录"
             })
         
-        import psycopg2
-        import psycopg2.extras
-        
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cursor.execute('''
-        SELECT 
-            purchase_id, 
-            email, 
-            product_name, 
-            processed, 
-            processed_at, 
-            created_at,
-            LENGTH(gumroad_data::text) as data_length
-        FROM purchases 
-        ORDER BY processed_at DESC 
-        LIMIT 50
-        ''')
-        
-        purchases = cursor.fetchall()
-        cursor.close()
-        put_db_connection(conn)
+        # 使用默认的元组游标，列名只返回一次，避免为每一行构造 dict
+        with get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                SELECT 
+                    purchase_id, 
+                    email, 
+                    product_name, 
+                    processed, 
+                    processed_at, 
+                    created_at,
+                    LENGTH(gumroad_data::text) as data_length
+                FROM purchases 
+                ORDER BY processed_at DESC 
+                LIMIT 50
+                ''')
+                
+                columns = [column[0] for column in cursor.description]
+                purchases = cursor.fetchall()
         
         return jsonify({
             "success": True,
             "count": len(purchases),
+            "columns": columns,
             "purchases": purchases
         })
         
@@ -1732,9 +2020,9 @@ def api_generate():
         logger.error(f"生成激活码失败: {e}")
         return jsonify({"error": "服务器错误"}), 500
 
+@app.route('/api/verify', methods=['POST'])
 @rate_limit('verify')
 @validate_request(['application/json'])
-@app.route('/api/verify', methods=['POST'])
 def api_verify():
     """验证激活码"""
     try:
@@ -1749,7 +2037,29 @@ def api_verify():
             return jsonify({"error": "激活码是必需的"}), 400
         
         # 清理激活码格式
-        code_clean = activation_code.replace('-', '').replace(' ', '')
+        code_clean = normalize_activation_code(activation_code)
+        
+        # 专业激活码先在本地校验，无效令牌不占用数据库连接
+        token_error = check_activation_token(code_clean)
+        if token_error:
+            logger.warning(f"❌ 激活码验证失败: {activation_code[:20]}... -> {token_error}")
+            return jsonify({
+                "valid": False,
+                "message": token_error,
+                "data": {}
+            })
+        
+        # 客户端会在启动和运行期间反复验证，短时间内复用上次的成功结果
+        # device_id 直接来自请求体，可能是列表等不可哈希的值，转为字符串作为缓存键
+        cache_key = ('verify', code_clean, str(device_id))
+        cached_data = get_cache(cache_key)
+        if cached_data:
+            logger.info(f"✅ 验证激活码（缓存）: {activation_code[:20]}... -> {device_id}")
+            return jsonify({
+                "valid": True,
+                "message": "激活成功",
+                "data": cached_data
+            })
         
         # 验证激活码
         if config.DATABASE_URL and database_initialized:
@@ -1774,6 +2084,7 @@ def api_verify():
         
         # 记录验证成功
         logger.info(f"✅ 验证激活码: {activation_code} -> {device_id}")
+        set_cache(cache_key, activation_data, ttl=config.VERIFY_CACHE_TTL)
         
         return jsonify({
             "valid": True,
@@ -1785,9 +2096,9 @@ def api_verify():
         logger.error(f"验证激活码失败: {e}")
         return jsonify({"error": "服务器错误"}), 500
 
+@app.route('/api/manual-activate', methods=['POST'])
 @rate_limit('default')
 @validate_request(['application/json'])
-@app.route('/api/manual-activate', methods=['POST'])
 def manual_activate():
     """手动触发激活（用于测试和调试）"""
     try:
@@ -1847,7 +2158,7 @@ def manual_activate():
         return jsonify({
             "success": True,
             "message": "手动激活成功",
-            "activation_code": activation_code,
+            "activation_code": format_activation_code(activation_code),
             "email": email,
             "product_name": product_name,
             "product_type": product_type,
@@ -1866,27 +2177,23 @@ def manual_activate():
 def list_activations():
     """列出激活码"""
     try:
+        columns = []
         activations = []
         
         if config.DATABASE_URL:
-            # 从数据库读取
+            # 从数据库读取（元组游标 + 列名列表，不逐行构造 dict）
             try:
-                import psycopg2
-                import psycopg2.extras
-                
-                conn = get_db_connection()
-                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                
-                cursor.execute('''
-                SELECT email, activation_code, product_type, generated_at 
-                FROM activations 
-                ORDER BY generated_at DESC 
-                LIMIT 50
-                ''')
-                
-                activations = cursor.fetchall()
-                cursor.close()
-                put_db_connection(conn)
+                with get_conn() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute('''
+                        SELECT email, activation_code, product_type, generated_at 
+                        FROM activations 
+                        ORDER BY generated_at DESC 
+                        LIMIT 50
+                        ''')
+                        
+                        columns = [column[0] for column in cursor.description]
+                        activations = cursor.fetchall()
                 
             except Exception as db_error:
                 logger.error(f"数据库查询失败: {db_error}")
@@ -1898,8 +2205,9 @@ def list_activations():
                 filename = "activations.csv"
                 
                 if os.path.exists(filename):
-                    with open(filename, 'r', encoding='utf-8') as f:
-                        reader = csv.DictReader(f)
+                    with open(filename, 'r', encoding='utf-8', newline='') as f:
+                        reader = csv.reader(f)
+                        columns = next(reader, [])
                         activations = list(reader)
             except Exception as file_error:
                 logger.error(f"文件读取失败: {file_error}")
@@ -1907,6 +2215,7 @@ def list_activations():
         return jsonify({
             "success": True,
             "count": len(activations),
+            "columns": columns,
             "activations": activations,
             "source": "database" if config.DATABASE_URL else "file"
         })
@@ -1956,6 +2265,14 @@ def internal_error(error):
 
 # ==================== 启动应用 ====================
 if __name__ == '__main__':
+    # 部署时初始化数据库: python activation_server.py migrate
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        sys.exit(0 if migrate_database() else 1)
+    
+    # 本地开发时可通过 INIT_DB=true 在启动前初始化数据库
+    if os.getenv('INIT_DB', 'False').lower() == 'true':
+        migrate_database()
+    
     port = int(config.SERVER_PORT)
     
     logger.info("=" * 60)
@@ -1979,6 +2296,10 @@ if __name__ == '__main__':
     heartbeat_thread.start()
     logger.info("💓 心跳保持线程已启动")
     
+    # 启动邮件发送线程
+    start_email_worker()
+    logger.info("📬 邮件发送线程已启动")
+    
     # 运行应用
     app.run(
         host='0.0.0.0', 
@@ -2,17 +2,20 @@
 初始化数据库
 """
 
+import os
 import psycopg2
 import logging
 
 logger = logging.getLogger(__name__)
 
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
 def init_database(database_url):
     """初始化数据库表"""
     
     # 读取SQL文件
     try:
-        with open('database/schema.sql', 'r', encoding='utf-8') as f:
+        with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
             sql_commands = f.read()
     except FileNotFoundError:
         logger.error("找不到 schema.sql 文件")
@@ -25,13 +28,9 @@ def init_database(database_url):
         conn.autocommit = False
         
         with conn.cursor() as cursor:
-            # 分割SQL命令并执行
-            commands = sql_commands.split(';')
-            
-            for command in commands:
-                command = command.strip()
-                if command:
-                    cursor.execute(command)
+            # 整个脚本一次执行（按 ; 分割会拆坏 $$ 包裹的函数体），
+            # 所有语句都是幂等的，可重复执行
+            cursor.execute(sql_commands)
             
             conn.commit()
         
@@ -49,7 +48,6 @@ def init_database(database_url):
 
 if __name__ == "__main__":
     import sys
-    import os
     
     if len(sys.argv) != 2:
         print("用法: python init_db.py <database_url>")
@@ -63,4 +61,4 @@ if __name__ == "__main__":
         sys.exit(0)
     else:
         print("❌ 数据库初始化失败")
-        sys.exit(1).
+        sys.exit(1)
@@ -48,13 +48,39 @@ CREATE TABLE IF NOT EXISTS purchases (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 待发送邮件表（后台发送失败的激活邮件，按退避时间定期重新发送）
+CREATE TABLE IF NOT EXISTS pending_emails (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    activation_code TEXT NOT NULL,
+    activation_data JSONB DEFAULT '{}',
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 激活码统一以规范形式存储（简单激活码去掉 -，专业激活码为原始 Fernet 令牌），
+-- 查询直接命中 activation_code 的 UNIQUE 约束索引
+UPDATE activations SET activation_code = REPLACE(activation_code, '-', '')
+WHERE activation_code LIKE 'PDF-%';
+
+-- UNIQUE 约束已自带索引，删除重复的普通索引
+DROP INDEX IF EXISTS idx_activations_code;
+DROP INDEX IF EXISTS idx_purchases_purchase_id;
+
 -- 创建索引
-CREATE INDEX IF NOT EXISTS idx_activations_code ON activations(activation_code);
 CREATE INDEX IF NOT EXISTS idx_activations_email ON activations(email);
 CREATE INDEX IF NOT EXISTS idx_activations_valid ON activations(valid_until);
-CREATE INDEX IF NOT EXISTS idx_purchases_purchase_id ON purchases(purchase_id);
 CREATE INDEX IF NOT EXISTS idx_purchases_email ON purchases(email);
-CREATE INDEX IF NOT EXISTS idx_device_activations ON device_activations(activation_id, device_id);
+
+-- 验证时统计已激活设备数：部分索引只包含 is_active 的行，可走 index-only scan
+-- （按 activation_id + device_id 查找设备由 UNIQUE 约束的索引负责）
+CREATE INDEX IF NOT EXISTS idx_device_activations_active ON device_activations(activation_id, device_id) WHERE is_active;
+DROP INDEX IF EXISTS idx_device_activations;
+
+-- 管理端按时间倒序列出激活码/购买记录，避免全表扫描加排序
+CREATE INDEX IF NOT EXISTS idx_activations_generated ON activations(generated_at DESC) INCLUDE (email, activation_code, product_type);
+CREATE INDEX IF NOT EXISTS idx_purchases_processed ON purchases(processed_at DESC);
 
 -- 创建更新时间的触发器
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -65,6 +91,8 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
+DROP TRIGGER IF EXISTS update_activations_updated_at ON activations;
+
 CREATE TRIGGER update_activations_updated_at 
     BEFORE UPDATE ON activations 
     FOR EACH ROW 
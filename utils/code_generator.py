@@ -2,7 +2,6 @@
 激活码生成器
 """
 
-import base64
 import json
 import hashlib
 from datetime import datetime, timedelta
@@ -39,32 +38,36 @@ class ActivationGenerator:
         ).hexdigest()[:8]
         activation_data['checksum'] = checksum
         
-        # 加密
+        # 加密（Fernet 令牌本身就是 URL 安全的 base64 文本，无需再编码）
         data_str = json.dumps(activation_data, separators=(',', ':'))
-        encrypted = self.cipher.encrypt(data_str.encode())
+        activation_code = self.cipher.encrypt(data_str.encode()).decode('ascii')
         
-        # Base64编码
-        activation_code = base64.urlsafe_b64encode(encrypted).decode()
-        
-        # 格式化为易读格式
+        # 格式化为易读格式，保留完整令牌（截断后将无法解密）
         formatted_code = '-'.join([
             activation_code[i:i+8] 
             for i in range(0, len(activation_code), 8)
-        ])[:59]  # 限制长度
+        ])
         
         return formatted_code, activation_data
     
+    @staticmethod
+    def _clean_code(activation_code: str) -> str:
+        """还原为原始 Fernet 令牌"""
+        code_clean = activation_code.replace(' ', '')
+        
+        # 令牌本身可能包含 -，只去掉格式化时每8位插入的分隔符
+        if len(code_clean) > 8 and all(c == '-' for c in code_clean[8::9]):
+            return ''.join(code_clean[i:i+8] for i in range(0, len(code_clean), 9))
+        return code_clean
+    
     def verify(self, activation_code: str) -> Tuple[bool, str, Dict[str, Any]]:
         """验证激活码"""
         try:
             # 清理格式
-            code_clean = activation_code.replace('-', '').replace(' ', '')
-            
-            # Base64解码
-            encrypted = base64.urlsafe_b64decode(code_clean + '=' * (4 - len(code_clean) % 4))
+            code_clean = self._clean_code(activation_code)
             
             # 解密
-            decrypted = self.cipher.decrypt(encrypted).decode()
+            decrypted = self.cipher.decrypt(code_clean.encode()).decode()
             activation_data = json.loads(decrypted)
             
             # 验证校验码
@@ -92,9 +95,8 @@ class ActivationGenerator:
     def decode(self, activation_code: str) -> Dict[str, Any]:
         """解码激活码（不验证）"""
         try:
-            code_clean = activation_code.replace('-', '').replace(' ', '')
-            encrypted = base64.urlsafe_b64decode(code_clean + '=' * (4 - len(code_clean) % 4))
-            decrypted = self.cipher.decrypt(encrypted).decode()
+            code_clean = self._clean_code(activation_code)
+            decrypted = self.cipher.decrypt(code_clean.encode()).decode()
             return json.loads(decrypted)
         except:
-            return {}.
+            return {}
@@ -4,6 +4,7 @@
 
 import smtplib
 import logging
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
@@ -14,12 +15,66 @@ class EmailSender:
     """邮件发送器"""
     
     def __init__(self, host: str, port: int, username: str, password: str, 
-                 from_email: Optional[str] = None):
+                 from_email: Optional[str] = None, timeout: float = 10):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.from_email = from_email or username
+        self.timeout = timeout  # SMTP 连接/读写超时（秒）
+        
+        # 复用已登录的 SMTP 连接，避免每封邮件都重新握手 TLS 和认证
+        self._server: Optional[smtplib.SMTP] = None
+        self._lock = threading.Lock()
+    
+    def _connect(self) -> smtplib.SMTP:
+        """建立并登录 SMTP 连接"""
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.starttls()
+            server.login(self.username, self.password)
+        except Exception:
+            # 握手或认证失败时关闭已建立的 socket，避免每次重试都泄漏一个连接
+            server.close()
+            raise
+        return server
+    
+    def _send(self, msg: MIMEMultipart):
+        """通过复用的 SMTP 连接发送邮件，连接失效时自动重连"""
+        with self._lock:
+            # 检测空闲期间被服务器断开的连接
+            if self._server is not None:
+                try:
+                    status = self._server.noop()[0]
+                except (smtplib.SMTPException, OSError):
+                    status = None
+                if status != 250:
+                    self._close()
+            
+            if self._server is None:
+                self._server = self._connect()
+            
+            try:
+                self._server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._close()
+                self._server = self._connect()
+                self._server.send_message(msg)
+    
+    def _close(self):
+        """关闭当前 SMTP 连接"""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            self._server.close()
+        self._server = None
+    
+    def close(self):
+        """关闭复用的 SMTP 连接"""
+        with self._lock:
+            self._close()
     
     def send_activation_email(self, to_email: str, activation_code: str, 
                             activation_data: dict) -> bool:
@@ -48,10 +103,7 @@ class EmailSender:
             msg.attach(MIMEText(html_content, 'html'))
             
             # 发送邮件
-            with smtplib.SMTP(self.host, self.port) as server:
-                server.starttls()
-                server.login(self.username, self.password)
-                server.send_message(msg)
+            self._send(msg)
             
             logger.info(f"✅ 激活邮件已发送到 {to_email}")
             return True
@@ -147,11 +199,11 @@ class EmailSender:
     def test_connection(self) -> bool:
         """测试邮件连接"""
         try:
-            with smtplib.SMTP(self.host, self.port) as server:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as server:
                 server.starttls()
                 server.login(self.username, self.password)
                 server.quit()
             return True
         except Exception as e:
             logger.error(f"邮件连接测试失败: {e}")
-            return False.
+            return False
@@ -16,19 +16,34 @@ class GumroadWebhook:
     
     def __init__(self, webhook_secret: str = ""):
         self.webhook_secret = webhook_secret
+        # 预先完成 HMAC 密钥处理，每个请求只需复制后写入数据
+        # （服务器目前不实例化本类，接入签名校验前不会带来实际收益）
+        self._hmac_prototype = hmac.new(webhook_secret.encode(), None, hashlib.sha256)
     
-    def verify_signature(self, payload: bytes, signature: str) -> bool:
-        """验证Webhook签名"""
+    def verify_signature(self, payload: bytes, signature: Optional[str]) -> bool:
+        """验证Webhook签名（常量时间比较）
+        
+        注意：activation_server.webhook_gumroad 目前不调用本方法，服务器端不做签名校验。
+        """
         if not self.webhook_secret:
             return True  # 如果没有设置密钥，跳过验证
         
-        expected_signature = hmac.new(
-            self.webhook_secret.encode(),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
+        h = self._hmac_prototype.copy()
+        h.update(payload)
+        expected_digest = h.digest()
+        
+        # 签名缺失、非十六进制或长度不符时与全零缓冲区比较，
+        # 保证每种失败情况都执行同样的比较，不通过响应时间泄露原因
+        try:
+            signature_bytes = bytes.fromhex(signature or "")
+        except ValueError:
+            signature_bytes = b""
         
-        return hmac.compare_digest(signature, expected_signature)
+        length_ok = len(signature_bytes) == len(expected_digest)
+        if not length_ok:
+            signature_bytes = bytes(len(expected_digest))
+        
+        return hmac.compare_digest(expected_digest, signature_bytes) and length_ok
     
     def parse_product_type(self, product_name: str) -> str:
         """从产品名称解析产品类型"""
@@ -119,4 +134,4 @@ class GumroadWebhook:
                 'success': False,
                 'error': str(e),
                 'raw_data': payload
-            }.
+            }